@@ -1,42 +1,173 @@
-import base64
-import difflib
-import json
+import asyncio
+import binascii
+import contextlib
+import functools
+import mmap
 import os
+import weakref
 from pathlib import Path
 
+import orjson
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.responses import JSONResponse
-from openai import OpenAI
+from openai import AsyncOpenAI
+from rapidfuzz import fuzz
 
 # Read API key from environment variable. Do NOT hardcode it.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
   raise RuntimeError("OPENAI_API_KEY environment variable is not set")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
 app = FastAPI(title="Visual Backend", version="0.1.0")
 
 VOICE_DB_PATH = Path(__file__).parent / "voice_db.json"
 
+OPENAI_MAX_INFLIGHT = int(os.getenv("OPENAI_MAX_INFLIGHT", "16"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))  # seconds
+
+VOICE_VERIFY_THRESHOLD = 0.6
+
+TRANSLATE_PROMPT_TMPL = (
+  "Translate the following text into language with locale code "
+  "{language}. Only return the translated text."
+)
+
+VISION_ANALYZE_PROMPT_TMPL = (
+  "You are a real-time assistant for a blind person. "
+  "Respond in language with locale code {language}. "
+  "Look at the image and give a very short description (2-4 sentences) "
+  "covering:\n"
+  "- main objects and their approximate distance and direction,\n"
+  "- floor condition (wet/dry, steps, slopes, obstacles),\n"
+  "- anything to be careful about (head-level obstacles, narrow spaces),\n"
+  "- if a laptop or TV screen is visible, briefly summarize any important text."
+)
+
+VISION_OCR_PROMPT_TMPL = (
+  "You see a photo that may contain a screen or printed text. "
+  "Read all clearly visible text in language with locale code {language}. "
+  "Return only the text, in reading order, without extra commentary."
+)
+
+# Parsed voice_db.json, reused until the file's mtime changes.
+_VOICE_DB_CACHE = {"mtime": 0.0, "data": {}}
+
+# asyncio primitives bind to the first loop that waits on them, so one is
+# created per running loop (uvicorn reloads, multiple TestClients).
+_voice_db_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_openai_semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _loop_local(registry: weakref.WeakKeyDictionary, factory):
+  loop = asyncio.get_running_loop()
+  value = registry.get(loop)
+  if value is None:
+    value = registry[loop] = factory()
+  return value
+
+
+@contextlib.contextmanager
+def _upload_view(upload: UploadFile):
+  # Expose the bytes Starlette already spooled without copying them: the
+  # in-memory buffer directly, or an mmap once it has rolled over to disk.
+  raw = getattr(upload.file, "_file", upload.file)
+  if hasattr(raw, "getbuffer"):
+    view = raw.getbuffer()
+    try:
+      yield view
+    finally:
+      view.release()
+    return
+  raw.flush()
+  if os.fstat(raw.fileno()).st_size == 0:
+    yield memoryview(b"")
+    return
+  with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+    view = memoryview(mapped)
+    try:
+      yield view
+    finally:
+      view.release()
+
+
+def _image_data_url(image: memoryview) -> str:
+  encoded = binascii.b2a_base64(image, newline=False)
+  return "data:image/jpeg;base64," + encoded.decode("ascii")
+
+
+def _read_voice_db() -> dict:
+  try:
+    mtime = VOICE_DB_PATH.stat().st_mtime
+  except FileNotFoundError:
+    return {}
+  if mtime == _VOICE_DB_CACHE["mtime"]:
+    return _VOICE_DB_CACHE["data"]
+  data = orjson.loads(VOICE_DB_PATH.read_bytes())
+  _VOICE_DB_CACHE.update(mtime=mtime, data=data)
+  return data
+
+
+def _write_voice_db(db: dict) -> None:
+  # Write a temp file and swap it in, so a crash mid-write never leaves a
+  # truncated voice_db.json behind.
+  tmp = VOICE_DB_PATH.with_suffix(".json.tmp")
+  with tmp.open("wb") as f:
+    f.write(orjson.dumps(db, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, VOICE_DB_PATH)
+  _VOICE_DB_CACHE.update(mtime=VOICE_DB_PATH.stat().st_mtime, data=db)
+
+
+async def _load_voice_db() -> dict:
+  async with _loop_local(_voice_db_locks, asyncio.Lock):
+    return await asyncio.to_thread(_read_voice_db)
+
+
+async def _update_voice_db(username: str, record: dict) -> None:
+  # Load, modify and save under one lock so concurrent enrollments can't
+  # overwrite each other. The cached dict is copied rather than mutated so
+  # a failed write leaves the cache matching the file on disk.
+  async with _loop_local(_voice_db_locks, asyncio.Lock):
+    db = dict(await asyncio.to_thread(_read_voice_db))
+    db[username] = record
+    await asyncio.to_thread(_write_voice_db, db)
+
+
+async def _bounded_openai_call(make_call):
+  # Bounded so a burst of requests can't pile up unlimited upstream calls,
+  # and timed out so a stuck call releases its slot.
+  semaphore = _loop_local(
+    _openai_semaphores, lambda: asyncio.Semaphore(OPENAI_MAX_INFLIGHT)
+  )
+  async with semaphore:
+    try:
+      return await asyncio.wait_for(make_call(), OPENAI_TIMEOUT)
+    except asyncio.TimeoutError as exc:
+      raise TimeoutError(f"OpenAI request timed out after {OPENAI_TIMEOUT:g}s") from exc
+
 
-def _load_voice_db() -> dict:
-  if VOICE_DB_PATH.exists():
-    with VOICE_DB_PATH.open("r", encoding="utf-8") as f:
-      return json.load(f)
-  return {}
+async def _create_chat_completion(**kwargs):
+  return await _bounded_openai_call(
+    functools.partial(aclient.chat.completions.create, **kwargs)
+  )
 
 
-def _save_voice_db(db: dict) -> None:
-  with VOICE_DB_PATH.open("w", encoding="utf-8") as f:
-    json.dump(db, f, ensure_ascii=False, indent=2)
+async def _create_transcription(**kwargs):
+  return await _bounded_openai_call(
+    functools.partial(aclient.audio.transcriptions.create, **kwargs)
+  )
 
 
 async def _transcribe_audio(upload: UploadFile) -> str:
-  data = await upload.read()
+  # Hand the spooled upload file straight to the SDK so the audio is never
+  # copied into a separate bytes object here.
+  await upload.seek(0)
   try:
-    transcript = client.audio.transcriptions.create(
+    transcript = await _create_transcription(
       model="whisper-1",
-      file=(upload.filename or "audio.m4a", data, upload.content_type or "audio/m4a"),
+      file=(upload.filename or "audio.m4a", upload.file, upload.content_type or "audio/m4a"),
     )
   except Exception as exc:  # noqa: BLE001
     raise HTTPException(status_code=500, detail=f"Transcription failed: {exc}") from exc
@@ -55,13 +186,10 @@ async def audio_transcribe_translate(
   """
   text = await _transcribe_audio(audio)
 
-  prompt = (
-    "Translate the following text into language with locale code "
-    f"{target_language}. Only return the translated text."
-  )
+  prompt = TRANSLATE_PROMPT_TMPL.format(language=target_language)
 
   try:
-    chat = client.chat.completions.create(
+    chat = await _create_chat_completion(
       model="gpt-4o-mini",
       messages=[
         {"role": "system", "content": prompt},
@@ -86,22 +214,13 @@ async def vision_analyze(
   floor condition (wet/dry, steps, slopes), obstacles, and if any screen is
   visible, summarize important on-screen text.
   """
-  image_bytes = await image.read()
-  image_b64 = base64.b64encode(image_bytes).decode("ascii")
-
-  prompt = (
-    "You are a real-time assistant for a blind person. "
-    f"Respond in language with locale code {language}. "
-    "Look at the image and give a very short description (2-4 sentences) "
-    "covering:\n"
-    "- main objects and their approximate distance and direction,\n"
-    "- floor condition (wet/dry, steps, slopes, obstacles),\n"
-    "- anything to be careful about (head-level obstacles, narrow spaces),\n"
-    "- if a laptop or TV screen is visible, briefly summarize any important text."
-  )
+  with _upload_view(image) as view:
+    image_url = _image_data_url(view)
+
+  prompt = VISION_ANALYZE_PROMPT_TMPL.format(language=language)
 
   try:
-    chat = client.chat.completions.create(
+    chat = await _create_chat_completion(
       model="gpt-4o-mini",
       messages=[
         {
@@ -111,7 +230,7 @@ async def vision_analyze(
             {
               "type": "image_url",
               "image_url": {
-                "url": f"data:image/jpeg;base64,{image_b64}",
+                "url": image_url,
               },
             },
           ],
@@ -135,17 +254,13 @@ async def vision_ocr(
   This uses the same vision model but focuses on text. The mobile app can
   optionally call this separately when it only cares about on-screen text.
   """
-  image_bytes = await image.read()
-  image_b64 = base64.b64encode(image_bytes).decode("ascii")
+  with _upload_view(image) as view:
+    image_url = _image_data_url(view)
 
-  prompt = (
-    "You see a photo that may contain a screen or printed text. "
-    f"Read all clearly visible text in language with locale code {language}. "
-    "Return only the text, in reading order, without extra commentary."
-  )
+  prompt = VISION_OCR_PROMPT_TMPL.format(language=language)
 
   try:
-    chat = client.chat.completions.create(
+    chat = await _create_chat_completion(
       model="gpt-4o-mini",
       messages=[
         {
@@ -155,7 +270,7 @@ async def vision_ocr(
             {
               "type": "image_url",
               "image_url": {
-                "url": f"data:image/jpeg;base64,{image_b64}",
+                "url": image_url,
               },
             },
           ],
@@ -184,9 +299,10 @@ async def voice_enroll(
   """
   phrase = await _transcribe_audio(audio)
 
-  db = _load_voice_db()
-  db[username] = {"phrase": phrase, "language": language}
-  _save_voice_db(db)
+  await _update_voice_db(
+    username,
+    {"phrase": phrase, "phrase_lower": phrase.lower(), "language": language},
+  )
 
   return JSONResponse({"status": "ok", "username": username})
 
@@ -202,20 +318,29 @@ async def voice_verify(
   a simple similarity measure. It is adequate for a demo but not for
   high-security authentication.
   """
-  db = _load_voice_db()
+  db = await _load_voice_db()
   if username not in db:
     raise HTTPException(status_code=404, detail="User not enrolled")
 
-  enrolled_phrase = db[username]["phrase"]
-  spoken_phrase = await _transcribe_audio(audio)
-
-  similarity = difflib.SequenceMatcher(
-    None,
-    enrolled_phrase.lower(),
-    spoken_phrase.lower(),
-  ).ratio()
-
-  verified = similarity >= 0.6
+  record = db[username]
+  enrolled = record.get("phrase_lower")
+  if enrolled is None:
+    # Enrolled before phrase_lower was stored; lowercase it here rather than
+    # writing back a record that a concurrent enrollment may have replaced.
+    enrolled = record["phrase"].lower()
+
+  spoken = (await _transcribe_audio(audio)).lower()
+  la, lb = len(enrolled), len(spoken)
+  if la == lb and enrolled == spoken:
+    return {"verified": True, "similarity": 1.0}
+  # The ratio can never exceed 2 * min / (la + lb), so phrases whose lengths
+  # differ too much cannot pass and are rejected without scoring them.
+  if 2 * min(la, lb) < VOICE_VERIFY_THRESHOLD * (la + lb):
+    return {"verified": False, "similarity": 0.0}
+
+  similarity = fuzz.ratio(enrolled, spoken) / 100.0
+
+  verified = similarity >= VOICE_VERIFY_THRESHOLD
   return {"verified": verified, "similarity": similarity}
 
 
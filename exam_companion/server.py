@@ -1,14 +1,14 @@
 import asyncio
-import json
-import threading
+from concurrent.futures import ThreadPoolExecutor
 import socket
 import os
 import sys
 import time
 from io import BytesIO
-import base64
 import tkinter as tk
 
+import numpy as np
+import orjson
 import pyautogui
 import websockets
 from mss import mss
@@ -19,6 +19,116 @@ try:
 except ImportError:
     winreg = None
 
+try:
+    from turbojpeg import TJPF_BGRA, TurboJPEG
+
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    # PyTurboJPEG or the libjpeg-turbo library is missing; use Pillow.
+    _turbo_jpeg = None
+
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    # Inject input with SendInput directly; pyautogui adds fail-safe checks
+    # and per-call pauses on top of the same primitive.
+    _user32 = ctypes.WinDLL("user32", use_last_error=True)
+
+    INPUT_MOUSE = 0
+    INPUT_KEYBOARD = 1
+    KEYEVENTF_KEYUP = 0x0002
+    KEYEVENTF_UNICODE = 0x0004
+    MOUSEEVENTF_LEFTDOWN = 0x0002
+    MOUSEEVENTF_LEFTUP = 0x0004
+    VK_TAB = 0x09
+    VK_RETURN = 0x0D
+
+    class MOUSEINPUT(ctypes.Structure):
+        _fields_ = [
+            ("dx", wintypes.LONG),
+            ("dy", wintypes.LONG),
+            ("mouseData", wintypes.DWORD),
+            ("dwFlags", wintypes.DWORD),
+            ("time", wintypes.DWORD),
+            ("dwExtraInfo", ctypes.c_size_t),
+        ]
+
+    class KEYBDINPUT(ctypes.Structure):
+        _fields_ = [
+            ("wVk", wintypes.WORD),
+            ("wScan", wintypes.WORD),
+            ("dwFlags", wintypes.DWORD),
+            ("time", wintypes.DWORD),
+            ("dwExtraInfo", ctypes.c_size_t),
+        ]
+
+    class HARDWAREINPUT(ctypes.Structure):
+        _fields_ = [
+            ("uMsg", wintypes.DWORD),
+            ("wParamL", wintypes.WORD),
+            ("wParamH", wintypes.WORD),
+        ]
+
+    class _INPUTUNION(ctypes.Union):
+        _fields_ = [("mi", MOUSEINPUT), ("ki", KEYBDINPUT), ("hi", HARDWAREINPUT)]
+
+    class INPUT(ctypes.Structure):
+        _fields_ = [("type", wintypes.DWORD), ("union", _INPUTUNION)]
+
+    def _send_inputs(inputs):
+        if not inputs:
+            return
+        array = (INPUT * len(inputs))(*inputs)
+        _user32.SendInput(len(inputs), array, ctypes.sizeof(INPUT))
+
+    def _mouse_input(flags):
+        return INPUT(type=INPUT_MOUSE, union=_INPUTUNION(mi=MOUSEINPUT(dwFlags=flags)))
+
+    def _key_inputs(vk=0, scan=0, flags=0):
+        return [
+            INPUT(type=INPUT_KEYBOARD, union=_INPUTUNION(ki=KEYBDINPUT(wVk=vk, wScan=scan, dwFlags=flags))),
+            INPUT(
+                type=INPUT_KEYBOARD,
+                union=_INPUTUNION(ki=KEYBDINPUT(wVk=vk, wScan=scan, dwFlags=flags | KEYEVENTF_KEYUP)),
+            ),
+        ]
+
+    def move(x, y):
+        _user32.SetCursorPos(int(x), int(y))
+
+    def click(x, y):
+        move(x, y)
+        _send_inputs([_mouse_input(MOUSEEVENTF_LEFTDOWN), _mouse_input(MOUSEEVENTF_LEFTUP)])
+
+    def type_text(text):
+        inputs = []
+        for ch in text:
+            if ch == "\n":
+                inputs += _key_inputs(vk=VK_RETURN)
+            elif ch == "\t":
+                inputs += _key_inputs(vk=VK_TAB)
+            else:
+                # KEYEVENTF_UNICODE takes UTF-16 code units, so characters
+                # outside the BMP are sent as a surrogate pair.
+                encoded = ch.encode("utf-16-le")
+                for i in range(0, len(encoded), 2):
+                    unit = int.from_bytes(encoded[i:i + 2], "little")
+                    inputs += _key_inputs(scan=unit, flags=KEYEVENTF_UNICODE)
+        _send_inputs(inputs)
+
+else:
+
+    def move(x, y):
+        pyautogui.moveTo(x, y)
+
+    def click(x, y):
+        pyautogui.click(x, y)
+
+    def type_text(text):
+        pyautogui.typewrite(text)
+
 
 HOST = "0.0.0.0"
 PORT = 8765
@@ -28,8 +138,32 @@ CONFIG_FILE_NAME = "config.json"
 RUN_KEY_PATH = r"Software\\Microsoft\\Windows\\CurrentVersion\\Run"
 RUN_VALUE_NAME = "VisualEyesPC"
 
+INACTIVITY_TIMEOUT = 7200  # seconds, temporary mode only
+GUI_TICK = 0.016  # seconds between Tk updates
+
+JPEG_QUALITY = 60
+
+# Delta screenshots ({"type": "screenshot", "delta": true}) only resend the
+# TILE_SIZE x TILE_SIZE tiles that changed since the previous frame. A full
+# keyframe is sent every KEYFRAME_INTERVAL frames, or sooner when more than
+# DELTA_MAX_CHANGED of the tiles changed: past that point the per-tile JPEG
+# headers and sends cost more than one full frame.
+TILE_SIZE = 64
+KEYFRAME_INTERVAL = 30
+DELTA_MAX_CHANGED = 0.15
+
 last_activity = time.time()
 mode = "temporary"
+_local_ip = None
+
+# Input injection runs off the event loop on a single worker thread so long
+# typewrites don't stall other clients, while commands keep their order.
+INPUT_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="input")
+
+# mss is not thread-safe, so the grabber is created lazily on the event loop
+# thread and reused for every screenshot after that.
+_sct = None
+_monitor = None
 
 
 def _get_config_path():
@@ -44,8 +178,8 @@ def load_mode():
     if not os.path.exists(path):
         return None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
         return data.get("mode")
     except Exception:
         return None
@@ -54,8 +188,8 @@ def load_mode():
 def save_mode(value):
     path = _get_config_path()
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({"mode": value}, f)
+        with open(path, "wb") as f:
+            f.write(orjson.dumps({"mode": value}))
     except Exception:
         return
 
@@ -81,24 +215,80 @@ def set_startup(enabled):
         return
 
 
-def get_local_ip():
+def get_local_ip(refresh=False):
+    global _local_ip
+    if _local_ip is not None and not refresh:
+        return _local_ip
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
-        return ip
     except Exception:
+        # Not cached, so a later call can pick up the network once it is up.
         return "127.0.0.1"
+    _local_ip = ip
+    return ip
+
+
+def _get_screenshotter():
+    global _sct, _monitor
+    if _sct is None:
+        _sct = mss()
+        _monitor = _sct.monitors[0]
+    return _sct, _monitor
+
+
+def _grab_frame():
+    # mss's native BGRA buffer is viewed directly instead of the converted
+    # copy behind screenshot.rgb.
+    sct, monitor = _get_screenshotter()
+    screenshot = sct.grab(monitor)
+    width, height = screenshot.size
+    return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(height, width, 4)
+
+
+def _encode_jpeg(frame, buf):
+    frame = np.ascontiguousarray(frame)
+    if _turbo_jpeg is not None:
+        return _turbo_jpeg.encode(frame, quality=JPEG_QUALITY, pixel_format=TJPF_BGRA)
+    height, width = frame.shape[:2]
+    img = Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1)
+    buf.seek(0)
+    buf.truncate()
+    img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+    return buf.getvalue()
+
+
+def _changed_tiles(prev, cur):
+    height, width = cur.shape[:2]
+    changed = prev.view(np.uint32)[..., 0] != cur.view(np.uint32)[..., 0]
+    rows = -(-height // TILE_SIZE)
+    cols = -(-width // TILE_SIZE)
+    padded = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=bool)
+    padded[:height, :width] = changed
+    tiles = padded.reshape(rows, TILE_SIZE, cols, TILE_SIZE).any(axis=(1, 3))
+    ys, xs = np.nonzero(tiles)
+    if len(ys) > DELTA_MAX_CHANGED * rows * cols:
+        return None
+    return [[int(x) * TILE_SIZE, int(y) * TILE_SIZE] for y, x in zip(ys, xs)]
+
+
+async def _run_input(func, *args):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(INPUT_POOL, func, *args)
 
 
 async def handle_client(websocket):
     global last_activity
     last_activity = time.time()
+    buf = BytesIO()
+    prev_frame = None
+    frames_since_key = 0
     async for message in websocket:
         try:
-            data = json.loads(message)
-        except json.JSONDecodeError:
+            data = orjson.loads(message)
+        except orjson.JSONDecodeError:
             continue
 
         last_activity = time.time()
@@ -108,56 +298,85 @@ async def handle_client(websocket):
             x = data.get("x")
             y = data.get("y")
             if x is not None and y is not None:
-                pyautogui.click(x, y)
+                await _run_input(click, x, y)
 
         elif cmd_type == "move":
             x = data.get("x")
             y = data.get("y")
             if x is not None and y is not None:
-                pyautogui.moveTo(x, y)
+                await _run_input(move, x, y)
 
         elif cmd_type == "type_text":
             text = data.get("text", "")
-            pyautogui.typewrite(text)
+            await _run_input(type_text, text)
 
         elif cmd_type == "key":
             key = data.get("key")
             if key:
-                pyautogui.press(key)
+                await _run_input(pyautogui.press, key)
 
         elif cmd_type == "screenshot":
-            with mss() as sct:
-                screenshot = sct.grab(sct.monitors[0])
-                img = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
-                buf = BytesIO()
-                img.save(buf, format="JPEG", quality=60)
-                encoded = base64.b64encode(buf.getvalue()).decode("ascii")
-                await websocket.send(json.dumps({"type": "screenshot", "data": encoded}))
+            frame = _grab_frame()
+            tiles = None
+            if (
+                data.get("delta")
+                and prev_frame is not None
+                and prev_frame.shape == frame.shape
+                and frames_since_key < KEYFRAME_INTERVAL
+            ):
+                tiles = _changed_tiles(prev_frame, frame)
+            prev_frame = frame
+
+            if tiles is None:
+                # A text header frame, then the raw JPEG as a binary frame.
+                frames_since_key = 0
+                await websocket.send(orjson.dumps({"type": "screenshot"}).decode())
+                await websocket.send(_encode_jpeg(frame, buf))
+            else:
+                # The header lists the [x, y] of each tile; one binary JPEG
+                # frame per tile follows in the same order.
+                frames_since_key += 1
+                await websocket.send(
+                    orjson.dumps({"type": "screenshot_delta", "tiles": tiles}).decode()
+                )
+                for x, y in tiles:
+                    tile = frame[y:y + TILE_SIZE, x:x + TILE_SIZE]
+                    await websocket.send(_encode_jpeg(tile, buf))
+
+
+async def _inactivity_watchdog():
+    # Sleep until the current inactivity deadline; if there was activity in
+    # the meantime, the deadline has moved and we just sleep again.
+    while True:
+        remaining = INACTIVITY_TIMEOUT - (time.time() - last_activity)
+        if remaining <= 0:
+            if mode == "temporary":
+                os._exit(0)
+            remaining = INACTIVITY_TIMEOUT
+        await asyncio.sleep(remaining)
+
+
+async def _drive_gui(root):
+    # Tk is pumped from the asyncio loop instead of root.mainloop(), so the
+    # GUI and the WebSocket server share a single thread.
+    while True:
+        try:
+            root.update()
+        except tk.TclError:
+            return  # window was destroyed
+        await asyncio.sleep(GUI_TICK)
 
 
 async def main():
+    root = build_gui()
     async with websockets.serve(handle_client, HOST, PORT):
         print(f"Exam companion WebSocket server listening on ws://{HOST}:{PORT}")
-        await asyncio.Future()  # run forever
-
+        watchdog = asyncio.create_task(_inactivity_watchdog())
+        await _drive_gui(root)
+        watchdog.cancel()
 
-def run_server():
-    asyncio.run(main())
-
-
-def start_inactivity_monitor():
-    def monitor():
-        while True:
-            time.sleep(60)
-            if mode == "temporary":
-                if time.time() - last_activity > 7200:
-                    os._exit(0)
 
-    t = threading.Thread(target=monitor, daemon=True)
-    t.start()
-
-
-def run_gui():
+def build_gui():
     root = tk.Tk()
     root.title("VisualEyes PC Companion")
 
@@ -212,11 +431,8 @@ def run_gui():
         )
         temp_btn.pack(padx=20, pady=(0, 15))
 
-    root.mainloop()
+    return root
 
 
 if __name__ == "__main__":
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
-    start_inactivity_monitor()
-    run_gui()
+    asyncio.run(main())
@@ -1,16 +1,52 @@
 import 'dart:convert';
+import 'dart:typed_data';
 
 import 'package:web_socket_channel/web_socket_channel.dart';
 
 class ExamModeService {
   WebSocketChannel? _channel;
+  Stream<dynamic>? _messages;
 
   void connect(String wsUrl) {
     _channel?.sink.close();
-    _channel = WebSocketChannel.connect(Uri.parse(wsUrl));
+    final channel = WebSocketChannel.connect(Uri.parse(wsUrl));
+    _channel = channel;
+    _messages = channel.stream.asBroadcastStream();
   }
 
-  Stream<dynamic>? get messages => _channel?.stream;
+  Stream<dynamic>? get messages => _messages;
+
+  /// JPEG screenshots from the PC companion. The server sends a
+  /// `{"type": "screenshot"}` text frame followed by a binary frame holding
+  /// the image bytes.
+  Stream<Uint8List>? get screenshots {
+    final messages = _messages;
+    if (messages == null) {
+      return null;
+    }
+    return _screenshotFrames(messages);
+  }
+
+  Stream<Uint8List> _screenshotFrames(Stream<dynamic> messages) async* {
+    var expectingImage = false;
+    await for (final message in messages) {
+      if (message is String) {
+        expectingImage = _isScreenshotHeader(message);
+      } else if (expectingImage && message is List<int>) {
+        expectingImage = false;
+        yield message is Uint8List ? message : Uint8List.fromList(message);
+      }
+    }
+  }
+
+  bool _isScreenshotHeader(String message) {
+    try {
+      final decoded = jsonDecode(message);
+      return decoded is Map && decoded['type'] == 'screenshot';
+    } catch (_) {
+      return false;
+    }
+  }
 
   void sendCommand(Map<String, dynamic> command) {
     final channel = _channel;
@@ -23,5 +59,6 @@ class ExamModeService {
   Future<void> disconnect() async {
     await _channel?.sink.close();
     _channel = null;
+    _messages = null;
   }
 }